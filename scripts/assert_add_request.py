@@ -7,9 +7,15 @@ import argparse
 import os
 import sys
 import uuid
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
-import requests
+import aiohttp
+import orjson
+
+try:
+    from uvloop import run as run_event_loop
+except ImportError:
+    from asyncio import run as run_event_loop
 
 HTTP_ENDPOINT = os.getenv("QUEUE_MATCHMAKING_GQL_ENDPOINT", "http://localhost:4000/api")
 
@@ -22,37 +28,76 @@ mutation($userId: String!, $rank: Int!) {
 }
 """
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+# Ask the server to hold idle pooled connections as long as the connector does.
+KEEP_ALIVE_HEADERS = {"Connection": "keep-alive", "Keep-Alive": "timeout=60, max=1000"}
+
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+                enable_cleanup_closed=True,
+            ),
+            headers=KEEP_ALIVE_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=5),
+        )
+    return _session
 
-def post_add_request(user_id: str, rank: int) -> Dict[str, Any]:
-    response = requests.post(
-        HTTP_ENDPOINT,
-        json={"query": MUTATION, "variables": {"userId": user_id, "rank": rank}},
-        timeout=5,
-    )
-    response.raise_for_status()
-    payload = response.json()
 
-    if "errors" in payload:
-        messages = ", ".join(err.get("message", str(err)) for err in payload["errors"])
+async def close_session() -> None:
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+async def post_add_request(
+    session: aiohttp.ClientSession, user_id: str, rank: int
+) -> Dict[str, Any]:
+    async with session.post(
+        HTTP_ENDPOINT,
+        data=orjson.dumps({"query": MUTATION, "variables": {"userId": user_id, "rank": rank}}),
+        headers=JSON_HEADERS,
+    ) as response:
+        response.raise_for_status()
+        payload = orjson.loads(await response.read())
+
+    if errors := payload.get("errors"):
+        messages = ", ".join(err.get("message", str(err)) for err in errors)
         raise RuntimeError(f"GraphQL errors: {messages}")
 
-    result = payload.get("data", {}).get("addRequest")
+    result = (payload.get("data") or {}).get("addRequest")
     if result is None:
         raise RuntimeError(f"Unexpected response payload: {payload}")
 
     return result
 
 
-def main(user_id: str, rank: int) -> int:
+async def main(user_id: str, rank: int) -> int:
+    try:
+        return await run_assertions(await get_session(), user_id, rank)
+    finally:
+        await close_session()
+
+
+async def run_assertions(session: aiohttp.ClientSession, user_id: str, rank: int) -> int:
     print(f"➕ Enqueuing {user_id} (rank {rank})")
-    first = post_add_request(user_id, rank)
+    first = await post_add_request(session, user_id, rank)
 
     if not first.get("ok"):
         print(f"❌ Expected success but got {first}")
         return 1
 
     print("✅ First enqueue succeeded, checking duplicate rejection…")
-    duplicate = post_add_request(user_id, rank)
+    duplicate = await post_add_request(session, user_id, rank)
 
     if duplicate.get("ok") is not False:
         print(f"❌ Expected duplicate to fail but got {duplicate}")
@@ -85,7 +130,7 @@ if __name__ == "__main__":
     user_id = args.user_id or f"script-user-{uuid.uuid4().hex}"
 
     try:
-        sys.exit(main(user_id, args.rank))
+        sys.exit(run_event_loop(main(user_id, args.rank)))
     except KeyboardInterrupt:
         sys.exit(1)
     except Exception as exc:
@@ -1,82 +1,267 @@
 #!/usr/bin/env python3
 """Enqueue players through the GraphQL mutation."""
 
+from __future__ import annotations
+
+import argparse
 import asyncio
 import csv
+import logging
 import os
+import queue
 import random
 import sys
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from typing import Iterable, Tuple
+from typing import Iterable, List, Optional, Tuple
+
+import aiohttp
+import orjson
+
+try:
+    from uvloop import run as run_event_loop
+except ImportError:
+    from asyncio import run as run_event_loop
 
-import requests
 HTTP_ENDPOINT = os.getenv("QUEUE_MATCHMAKING_GQL_ENDPOINT", "http://localhost:4000/api")
 PLAYER_DATA = Path(__file__).resolve().parent / "player_data.csv"
 
-MUTATION = """
-mutation($userId: String!, $rank: Int!) {
-  addRequest(userId: $userId, rank: $rank) {
-    ok
-    error
-  }
-}
-"""
-
-def add_request(user_id: str, rank: int) -> None:
-    response = requests.post(
+ADD_REQUEST_FIELD = "a{i}: addRequest(userId: $u{i}, rank: $r{i}) {{ ok error }}"
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+# Ask the server to hold idle pooled connections as long as the connector does.
+KEEP_ALIVE_HEADERS = {"Connection": "keep-alive", "Keep-Alive": "timeout=60, max=1000"}
+
+Player = Tuple[str, int]
+
+_BODY_TEMPLATE = b'{"query":%s,"variables":%s}'
+
+
+@lru_cache(maxsize=None)
+def batch_query_json(size: int) -> bytes:
+    """Serialised mutation document with `size` aliased addRequest fields.
+
+    The server runs mutation fields in document order, so a batch keeps the
+    CSV arrival order while costing a single round trip.
+    """
+    params = ", ".join(f"$u{i}: String!, $r{i}: Int!" for i in range(size))
+    fields = " ".join(ADD_REQUEST_FIELD.format(i=i) for i in range(size))
+    return orjson.dumps(f"mutation({params}) {{ {fields} }}")
+
+
+def mutation_body(players: List[Player]) -> bytes:
+    variables = {}
+    for i, (user_id, rank) in enumerate(players):
+        variables[f"u{i}"] = user_id
+        variables[f"r{i}"] = rank
+    return _BODY_TEMPLATE % (batch_query_json(len(players)), orjson.dumps(variables))
+
+
+def batch_size() -> int:
+    raw_value = os.getenv("QUEUE_MATCHMAKING_MUTATION_BATCH_SIZE", "25")
+    try:
+        value = int(raw_value)
+    except ValueError:
+        raise ValueError(
+            f"QUEUE_MATCHMAKING_MUTATION_BATCH_SIZE must be an integer, got {raw_value!r}"
+        ) from None
+
+    if value <= 0:
+        raise ValueError(
+            f"QUEUE_MATCHMAKING_MUTATION_BATCH_SIZE must be > 0, got {raw_value!r}"
+        )
+
+    return value
+
+
+log = logging.getLogger("gql_mutation")
+
+
+def start_log_listener() -> QueueListener:
+    """Route log output through a background thread.
+
+    Writing to stdout blocks, so the event loop only enqueues records and the
+    listener thread does the actual write.
+    """
+    records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(records, handler)
+    log.addHandler(QueueHandler(records))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    listener.start()
+    return listener
+
+
+def concurrency_limit() -> int:
+    raw_value = os.getenv("QUEUE_MATCHMAKING_MUTATION_CONCURRENCY", "50")
+    try:
+        value = int(raw_value)
+    except ValueError:
+        raise ValueError(
+            f"QUEUE_MATCHMAKING_MUTATION_CONCURRENCY must be an integer, got {raw_value!r}"
+        ) from None
+
+    if value <= 0:
+        raise ValueError(
+            f"QUEUE_MATCHMAKING_MUTATION_CONCURRENCY must be > 0, got {raw_value!r}"
+        )
+
+    return value
+
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        # One pooled connection per enqueue worker: every in-flight mutation
+        # gets its own keep-alive socket instead of queueing behind another
+        # request on a shared HTTP/1.1 connection.
+        pool_size = concurrency_limit()
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=pool_size,
+                limit_per_host=pool_size,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+                enable_cleanup_closed=True,
+            ),
+            headers=KEEP_ALIVE_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=5),
+        )
+    return _session
+
+
+async def close_session() -> None:
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+async def add_requests(session: aiohttp.ClientSession, players: List[Player]) -> None:
+    async with session.post(
         HTTP_ENDPOINT,
-        json={"query": MUTATION, "variables": {"userId": user_id, "rank": rank}},
-        timeout=5,
-    )
-    payload = response.json()
-    result = payload.get("data", {}).get("addRequest")
-    if not result or not result.get("ok"):
-        raise RuntimeError(f"addRequest failed: {payload}")
+        data=mutation_body(players),
+        headers=JSON_HEADERS,
+    ) as response:
+        payload = orjson.loads(await response.read())
+    data = payload.get("data") or {}
+    for i, (user_id, _rank) in enumerate(players):
+        result = data.get(f"a{i}")
+        if not result or not result.get("ok"):
+            raise RuntimeError(f"addRequest failed for {user_id}: {result or payload}")
 
 
-def load_players(parity: str) -> Iterable[Tuple[str, int]]:
+def load_players(parity: str) -> Iterable[Player]:
     if not PLAYER_DATA.exists():
         raise FileNotFoundError(f"Player data CSV not found at {PLAYER_DATA}")
 
+    skip = 0 if parity == "odd" else 1
     with PLAYER_DATA.open("r", newline="") as handle:
-        reader = csv.DictReader(handle)
+        reader = csv.reader(handle)
+        header = next(reader, None)
+        if header is None:
+            return
+        user_col, rank_col = header.index("userId"), header.index("rank")
         for idx, row in enumerate(reader, start=1):
-            if parity == "odd" and idx % 2 == 0:
+            if idx % 2 == skip:
                 continue
-            if parity == "even" and idx % 2 == 1:
-                continue
-            yield row["userId"], int(row["rank"])
+            yield row[user_col], int(row[rank_col])
 
 
-async def enqueue_players(parity: str) -> None:
-    players = list(load_players(parity))
+async def produce_batches(
+    batches: asyncio.Queue[Optional[List[Player]]],
+    parity: str,
+    workers: int,
+    pacer: Optional[random.Random] = None,
+) -> None:
+    # Pacing spreads arrivals out in time: each player waits its own delay here
+    # and is sent on its own, rather than workers sleeping side by side.
+    size = 1 if pacer is not None else batch_size()
+    batch: List[Player] = []
+    for player in load_players(parity):
+        if pacer is not None:
+            await asyncio.sleep(pacer.uniform(0.001, 1.0))
+        batch.append(player)
+        if len(batch) == size:
+            await batches.put(batch)
+            batch = []
+    if batch:
+        await batches.put(batch)
+    for _ in range(workers):
+        await batches.put(None)
 
-    if not players:
-        print(f"No players matched the '{parity}' selection.")
-        return
 
-    print(f"▶️  Enqueuing {len(players)} {parity} players")
-    for user_id, rank in players:
-        add_request(user_id, rank)
-        print(f"  • Enqueued {user_id} (rank {rank})")
-        delay = random.uniform(0.001, 1.0)
-        print(f" • Sleeping for {delay}")
-        await asyncio.sleep(delay)
+async def enqueue_worker(
+    batches: asyncio.Queue[Optional[List[Player]]],
+    session: aiohttp.ClientSession,
+) -> int:
+    enqueued = 0
+    while (batch := await batches.get()) is not None:
+        await add_requests(session, batch)
+        for user_id, rank in batch:
+            log.info("  • Enqueued %s (rank %d)", user_id, rank)
+        enqueued += len(batch)
+    return enqueued
 
-    print("✅ Completed mutation batch")
 
+async def enqueue_players(parity: str, pacer: Optional[random.Random] = None) -> None:
+    session = await get_session()
+    workers = concurrency_limit()
+    batches: asyncio.Queue[Optional[List[Player]]] = asyncio.Queue(maxsize=workers)
 
-async def main(parity: str) -> None:
-    await enqueue_players(parity)
+    log.info("▶️  Enqueuing %s players", parity)
+    _, *counts = await asyncio.gather(
+        produce_batches(batches, parity, workers, pacer),
+        *(enqueue_worker(batches, session) for _ in range(workers)),
+    )
 
+    total = sum(counts)
+    if not total:
+        log.info("No players matched the '%s' selection.", parity)
+        return
 
-if __name__ == "__main__":
+    log.info("✅ Completed mutation batch (%d players)", total)
+
+
+async def main(parity: str, pacer: Optional[random.Random] = None) -> None:
+    listener = start_log_listener()
     try:
-        if len(sys.argv) != 2 or sys.argv[1] not in {"odd", "even"}:
-            print("Usage: python scripts/gql_mutation.py [odd|even]")
-            sys.exit(1)
+        await enqueue_players(parity, pacer)
+    finally:
+        await close_session()
+        listener.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "parity",
+        choices=["odd", "even"],
+        help="Enqueue the odd- or even-indexed players from player_data.csv.",
+    )
+    parser.add_argument(
+        "--pace",
+        action="store_true",
+        help="Send players one at a time, each after a random 1ms-1s delay, instead of all at once.",
+    )
+    parser.add_argument(
+        "--pace-seed",
+        type=int,
+        default=None,
+        help="Seed the --pace delays so the send timeline repeats across runs. Implies --pace.",
+    )
+
+    args = parser.parse_args()
 
-        selection = sys.argv[1]
-        asyncio.run(main(selection))
+    try:
+        pace = args.pace or args.pace_seed is not None
+        pacer = random.Random(args.pace_seed) if pace else None
+        run_event_loop(main(args.parity, pacer))
     except KeyboardInterrupt:
         sys.exit(1)
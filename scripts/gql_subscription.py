@@ -1,20 +1,33 @@
 #!/usr/bin/env python3
 """Exercise GraphQL subscriptions using the gql library (graphql-transport-ws)."""
 
+from __future__ import annotations
+
+import argparse
 import asyncio
 import csv
+import logging
 import os
+import queue
 import sys
+from contextlib import aclosing
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Iterable, Optional
 
-import requests
 from gql import Client, gql
+from gql.client import AsyncClientSession
 from gql.transport.websockets import WebsocketsTransport
 
+try:
+    from uvloop import run as run_event_loop
+except ImportError:
+    from asyncio import run as run_event_loop
+
 WS_ENDPOINT = os.getenv(
     "QUEUE_MATCHMAKING_GQL_WS_ENDPOINT", "ws://localhost:4000/graphql/websocket"
 )
+WS_SUBPROTOCOLS = ["graphql-transport-ws"]
 
 SUBSCRIPTION = gql(
     """
@@ -30,6 +43,37 @@ SUBSCRIPTION = gql(
     """
 )
 
+ADD_REQUEST = gql(
+    """
+    mutation($userId: String!, $rank: Int!) {
+      addRequest(userId: $userId, rank: $rank) {
+        ok
+        error
+      }
+    }
+    """
+)
+
+
+log = logging.getLogger("gql_subscription")
+
+
+def start_log_listener() -> QueueListener:
+    """Route log output through a background thread.
+
+    Writing to stdout blocks, so the event loop only enqueues records and the
+    listener thread does the actual write.
+    """
+    records: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(records, handler)
+    log.addHandler(QueueHandler(records))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    listener.start()
+    return listener
+
 
 def concurrency_limit() -> int:
     raw_value = os.getenv("QUEUE_MATCHMAKING_SUBSCRIPTION_CONCURRENCY", "50")
@@ -48,15 +92,57 @@ def concurrency_limit() -> int:
     return value
 
 
-async def subscribe_once(user_id: str) -> dict[str, Any]:
-    transport = WebsocketsTransport(url=WS_ENDPOINT, subprotocols=["graphql-transport-ws"])
-    async with Client(
-        transport=transport,
-        fetch_schema_from_transport=False,
-    ) as session:
-        async for result in session.subscribe(SUBSCRIPTION, variable_values={"userId": user_id}):
-            return result
-    raise RuntimeError("Subscription completed without emitting data")
+def handshake_timeout() -> float:
+    raw_value = os.getenv("QUEUE_MATCHMAKING_WS_HANDSHAKE_TIMEOUT", "10")
+    try:
+        value = float(raw_value)
+    except ValueError:
+        raise ValueError(
+            f"QUEUE_MATCHMAKING_WS_HANDSHAKE_TIMEOUT must be a number, got {raw_value!r}"
+        ) from None
+
+    if value <= 0:
+        raise ValueError(
+            f"QUEUE_MATCHMAKING_WS_HANDSHAKE_TIMEOUT must be > 0, got {raw_value!r}"
+        )
+
+    return value
+
+
+async def add_request(session: AsyncClientSession, user_id: str, rank: int) -> None:
+    result = await session.execute(
+        ADD_REQUEST, variable_values={"userId": user_id, "rank": rank}
+    )
+    outcome = result.get("addRequest")
+    if not outcome or not outcome.get("ok"):
+        raise RuntimeError(f"addRequest failed for {user_id}: {result}")
+
+
+async def subscribe_once(
+    session: AsyncClientSession, user_id: str, enqueue_rank: Optional[int] = None
+) -> dict[str, Any]:
+    """Wait for the first matchFound event for `user_id`.
+
+    With `enqueue_rank`, the user is also enqueued over the same websocket once
+    the subscription has been started, so the mutation frame follows the
+    subscribe frame on the connection.
+    """
+    subscription = session.subscribe(SUBSCRIPTION, variable_values={"userId": user_id})
+    async with aclosing(subscription):
+        first = asyncio.ensure_future(anext(subscription, None))
+        try:
+            if enqueue_rank is not None:
+                await asyncio.sleep(0)
+                await add_request(session, user_id, enqueue_rank)
+            result = await first
+        finally:
+            if not first.done():
+                first.cancel()
+                await asyncio.wait([first])
+
+    if result is None:
+        raise RuntimeError("Subscription completed without emitting data")
+    return result
 
 
 def load_players(csv_path: Path) -> Iterable[tuple[str, int]]:
@@ -66,37 +152,72 @@ def load_players(csv_path: Path) -> Iterable[tuple[str, int]]:
             yield row["userId"], int(row["rank"])
 
 
-async def monitor_user(user_id: str, rank: int, semaphore: asyncio.Semaphore) -> None:
-    print(f"▶️  Subscribing for {user_id} (rank {rank})")
+async def monitor_user(
+    session: AsyncClientSession,
+    user_id: str,
+    rank: int,
+    semaphore: asyncio.Semaphore,
+    enqueue: bool = False,
+) -> None:
+    log.info("▶️  Subscribing for %s (rank %d)", user_id, rank)
     async with semaphore:
-        result = await subscribe_once(user_id)
+        result = await subscribe_once(session, user_id, rank if enqueue else None)
 
         match = result.get("matchFound")
         if not match:
-            print(f"⚠️  Subscription for {user_id} returned unexpected payload: {result}")
+            log.info("⚠️  Subscription for %s returned unexpected payload: %s", user_id, result)
             return
 
-        users = sorted(u["userId"] for u in match["users"])
+        users = [u["userId"] for u in match["users"]]
+        users.sort()
         delta = match["delta"]
-        print(f"✅ Match for {user_id}: users={users}, delta={delta}")
+        log.info("✅ Match for %s: users=%s, delta=%s", user_id, users, delta)
 
 
-async def main() -> None:
+async def monitor_players(enqueue: bool = False) -> None:
     csv_path = Path(__file__).resolve().parent / "player_data.csv"
     players = list(load_players(csv_path))
 
     if not players:
-        print(f"No player entries found in {csv_path}")
+        log.info("No player entries found in %s", csv_path)
         return
 
     semaphore = asyncio.Semaphore(concurrency_limit())
-    await asyncio.gather(
-        *(monitor_user(user_id, rank, semaphore) for user_id, rank in players)
+    timeout = handshake_timeout()
+    transport = WebsocketsTransport(
+        url=WS_ENDPOINT,
+        subprotocols=WS_SUBPROTOCOLS,
+        connect_timeout=timeout,
+        ack_timeout=timeout,
     )
+    async with Client(
+        transport=transport,
+        fetch_schema_from_transport=False,
+    ) as session:
+        async with asyncio.TaskGroup() as tg:
+            for user_id, rank in players:
+                tg.create_task(monitor_user(session, user_id, rank, semaphore, enqueue))
+
+
+async def main(enqueue: bool = False) -> None:
+    listener = start_log_listener()
+    try:
+        await monitor_players(enqueue)
+    finally:
+        listener.stop()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="Also enqueue each player with addRequest over the subscription websocket.",
+    )
+
+    args = parser.parse_args()
+
     try:
-        asyncio.run(main())
+        run_event_loop(main(args.enqueue))
     except KeyboardInterrupt:
         sys.exit(1)